@@ -5,20 +5,25 @@ https://raw.githubusercontent.com/nasa/opera-sds-pcm/refs/heads/develop/geo/nort
 
 """
 
+from functools import lru_cache
 from pathlib import Path
 
 import geopandas as gpd
 from shapely import GeometryType
 
 
+@lru_cache(maxsize=1)
 def get_opera_na_shape() -> GeometryType.MULTIPOLYGON:
     """Read the OPERA North America geometry as a shapely `multipolygon`.
 
     Data source
     https://raw.githubusercontent.com/nasa/opera-sds-pcm/refs/heads/develop/geo/north_america_opera.geojson
 
+    The packaged file is only read once per process; later calls return the
+    cached geometry.
+
     """
     filename = Path(__file__).parent / "data" / "north_america_opera.geojson.zip"
-    na_gpd = gpd.read_file(filename)
+    na_gpd = gpd.read_file(filename, engine="pyogrio")
     # Combine all geometries in the GeoDataFrame into one MultiPolygon
     return na_gpd.geometry.unary_union
@@ -1,18 +1,23 @@
 #!/usr/bin/env python
+from __future__ import annotations
+
 import contextlib
 import datetime
 import logging
 import sqlite3
 import time
+from functools import lru_cache, partial
 from pathlib import Path
 
 import click
 import geopandas as gpd
 import numpy as np
 import pandas as pd
-import utm  # https://github.com/Turbo87/utm
+import pyarrow as pa
+import pyarrow.compute as pc
+import shapely
+from pyproj import Transformer
 from shapely import GeometryType, STRtree
-from shapely.affinity import translate
 from tqdm.auto import tqdm
 
 from burst_db import VERSION_EXTRA_CLEAN, __version__
@@ -22,7 +27,7 @@ from ._esa_burst_db import ESA_DB_URL, get_esa_burst_db
 from ._land_usgs import GREENLAND_URL, USGS_LAND_URL, get_greenland_shape, get_land_df
 from ._opera_north_america import get_opera_na_shape
 from .create_2d_geojsons import create_2d_geojsons
-from .utils import write_zipped_json
+from .utils import thread_map_chunks, write_zipped_json
 
 # Threshold to use EPSG:3413, Sea Ice Polar North (https://epsg.io/3413)
 NORTH_THRESHOLD = 75
@@ -33,18 +38,27 @@ SOUTH_EPSG = 3031
 
 logger = logging.getLogger("burst_db")
 
+# Dtypes of the ESA columns as read from the database, which `create` downcasts
+_ESA_BURST_DTYPES = {
+    "relative_orbit_number": np.int64,
+    "burst_id": np.int64,
+    "subswath_name": object,
+}
+
 
 def make_jpl_burst_id(df: pd.DataFrame):
     """Make the JPL burst ID from the ESA burst ID."""
-    burst_id_jpl = (
-        "t"
-        + df["relative_orbit_number"].astype(str).str.zfill(3)
-        + "_"
-        + df["burst_id"].astype(str).str.zfill(6)
-        + "_"
-        + df["subswath_name"].str.lower()
+    # Format with Arrow's string kernels, which work over the contiguous UTF-8
+    # buffers rather than building intermediate arrays of Python/NumPy strings
+    track = pc.utf8_lpad(
+        pc.cast(pa.array(df["relative_orbit_number"]), pa.string()), 3, "0"
     )
-    return burst_id_jpl
+    burst_id = pc.utf8_lpad(pc.cast(pa.array(df["burst_id"]), pa.string()), 6, "0")
+    subswath = pc.utf8_lower(pa.array(df["subswath_name"], type=pa.string()))
+    burst_id_jpl = pc.binary_join_element_wise(
+        pc.binary_join_element_wise("t", track, ""), burst_id, subswath, "_"
+    ).to_numpy(zero_copy_only=False)
+    return pd.Series(burst_id_jpl, index=df.index)
 
 
 def _setup_spatialite_con(con: sqlite3.Connection):
@@ -60,6 +74,34 @@ def _setup_spatialite_con(con: sqlite3.Connection):
     con.execute("SELECT EnableGpkgAmphibiousMode();")
 
 
+@contextlib.contextmanager
+def _spatialite_connection(outfile: str):
+    """Open `outfile` with spatialite loaded and fast bulk-write PRAGMAs set.
+
+    The changes are committed (or rolled back on error), and the connection is
+    closed on exit. The PRAGMAs trade crash safety for speed, which is fine for
+    a database that is rebuilt from scratch if anything fails.
+    """
+    con = sqlite3.connect(outfile)
+    try:
+        _setup_spatialite_con(con)
+        con.execute("PRAGMA synchronous = OFF;")
+        # Not WAL: it's persistent in the file header, so the output GPKG would be
+        # shipped in WAL mode (with -wal/-shm sidecars), and with one writer and
+        # `synchronous = OFF` it doesn't save anything over an in-memory journal
+        con.execute("PRAGMA journal_mode = MEMORY;")
+        # Negative means KiB: use a 512 MiB page cache
+        con.execute("PRAGMA cache_size = -524288;")
+        # Read the pages through mmap, and keep temp b-trees (sorts for the
+        # index builds, `ANALYZE`) in memory rather than in temp files
+        con.execute("PRAGMA mmap_size = 30000000000;")
+        con.execute("PRAGMA temp_store = MEMORY;")
+        with con:
+            yield con
+    finally:
+        con.close()
+
+
 def make_burst_triplets(df_burst: pd.DataFrame) -> pd.DataFrame:
     """Make a burst triplets dataframe, aggregating IW1,2,3 from the burst dataframe."""
 
@@ -68,46 +110,125 @@ def make_burst_triplets(df_burst: pd.DataFrame) -> pd.DataFrame:
         orbits_str = list(map(str, orbits))
         return ",".join(orbits_str)
 
-    df_burst_triplet_temp = df_burst.dissolve(
-        by="burst_id",
-        aggfunc={
-            "OGC_FID": ["min", "max"],
-            "relative_orbit_number": join_track_numbers,
-            "orbit_pass": "first",
-        },
-        as_index=False,
+    # Skip the per-group `dissolve`, and union the (up to 3) subswaths at once.
+    # The subswaths overlap, so the faster coverage union can't be used.
+    burst_ids, triplet_geoms = _union_groups(
+        df_burst.geometry.to_numpy(), df_burst["burst_id"].to_numpy()
+    )
+
+    df_attrs = df_burst.groupby("burst_id", sort=True).agg(
+        OGC_FID_min=("OGC_FID", "min"),
+        OGC_FID_max=("OGC_FID", "max"),
+        orbit_min=("relative_orbit_number", "min"),
+        orbit_max=("relative_orbit_number", "max"),
+        look_direction=("orbit_pass", "first"),
     )
-    df_burst_triplet = df_burst_triplet_temp.reset_index(drop=True)
-    df_burst_triplet.columns = [
-        "burst_id",
-        "geom",
-        "OGC_FID_min",
-        "OGC_FID_max",
-        "relative_orbit_numbers",
-        "look_direction",
+    relative_orbit_numbers = df_attrs["orbit_min"].astype(str)
+    # Only the few burst IDs spanning two tracks need their numbers joined
+    is_mixed = (df_attrs["orbit_min"] != df_attrs["orbit_max"]).to_numpy()
+    if is_mixed.any():
+        df_mixed = df_burst[df_burst["burst_id"].isin(burst_ids[is_mixed])]
+        relative_orbit_numbers[is_mixed] = df_mixed.groupby("burst_id")[
+            "relative_orbit_number"
+        ].agg(join_track_numbers)
+
+    df_burst_triplet = gpd.GeoDataFrame(
+        {
+            "burst_id": burst_ids,
+            "OGC_FID_min": df_attrs["OGC_FID_min"].to_numpy(),
+            "OGC_FID_max": df_attrs["OGC_FID_max"].to_numpy(),
+            "relative_orbit_numbers": relative_orbit_numbers.to_numpy(),
+            "look_direction": df_attrs["look_direction"].to_numpy(),
+        },
+        geometry=gpd.GeoSeries(triplet_geoms, crs=df_burst.crs),
+    ).rename_geometry("geom")
+    # Match the column order of the `dissolve` output
+    return df_burst_triplet[
+        [
+            "burst_id",
+            "geom",
+            "OGC_FID_min",
+            "OGC_FID_max",
+            "relative_orbit_numbers",
+            "look_direction",
+        ]
     ]
-    return df_burst_triplet
 
 
-def get_intersect_indicator(gdf: gpd.GeoDataFrame, test_geom: GeometryType.POLYGON):
-    """Get a boolean array indicating if each row of `gdf` intersects `test_geom`."""
-    tree = STRtree(gdf.geometry)
-    idxs_land = tree.query(test_geom, predicate="intersects")
-    if idxs_land.ndim == 2:
-        idxs_land = idxs_land[1]
-    is_in_land = gdf.index.isin(idxs_land)
+def _union_groups(geoms: np.ndarray, labels: np.ndarray, max_workers=None):
+    """Union the geometries which share each label.
+
+    Returns the sorted unique labels, and the union of each label's geometries.
+    The groups are padded into the rows of a 2D array (with `None`, which is
+    ignored), so that chunks of groups are unioned in vectorized calls, across a
+    thread pool.
+    """
+    order = np.argsort(labels, kind="stable")
+    keys, starts, counts = np.unique(
+        labels[order], return_index=True, return_counts=True
+    )
+    rows = np.repeat(np.arange(len(keys)), counts)
+    cols = np.arange(len(labels)) - np.repeat(starts, counts)
+    padded = np.full((len(keys), counts.max()), None, dtype=object)
+    padded[rows, cols] = geoms[order]
+
+    unions = thread_map_chunks(
+        partial(shapely.union_all, axis=1), padded, max_workers=max_workers
+    )
+    return keys, unions
+
+
+def get_intersect_indicator(
+    gdf: gpd.GeoDataFrame,
+    test_geom: GeometryType.POLYGON,
+    tree: STRtree | None = None,
+):
+    """Get a boolean array indicating if each row of `gdf` intersects `test_geom`.
+
+    `test_geom` may be a single (Multi)Polygon or an array of them.
+
+    An STRtree already built on `gdf.geometry` can be passed as `tree` to reuse
+    it across multiple queries.
+    """
+    if tree is None:
+        tree = STRtree(gdf.geometry.values)
+    # Query with each part of a (Multi)`test_geom` separately: one envelope around
+    # a whole continent returns every row in its bounding box as a candidate
+    test_parts = shapely.get_parts(np.asarray(test_geom))
+    # (`query` filters on the envelopes in the tree first, then runs the exact
+    # `intersects` on a prepared copy of each part, only for those candidates)
+    _, idxs_land = tree.query(test_parts, predicate="intersects")
+    # The tree indices are positions, not index labels
+    is_in_land = np.zeros(len(gdf), dtype=bool)
+    is_in_land[idxs_land] = True
     return is_in_land
 
 
 def make_frame_to_burst_table(outfile: str, df_frame_to_burst_id: pd.DataFrame):
     """Create the frames_bursts table and indexes."""
-    with sqlite3.connect(outfile) as con:
-        _setup_spatialite_con(con)
-
-        df_frame_to_burst_id.to_sql("frames_bursts", con, if_exists="replace")
+    with _spatialite_connection(outfile) as con:
+        # The frame's `is_land` is only used to build the `frames` table, so it's
+        # left out here, rather than dropping the column (a full rewrite) later.
+        # Insert in bulk, then create the indexes, rather than going through
+        # `to_sql` (which also adds an index on the "index" column up front).
+        con.execute("DROP TABLE IF EXISTS frames_bursts;")
+        con.execute(
+            'CREATE TABLE frames_bursts ("index" INTEGER PRIMARY KEY, frame_fid'
+            " INTEGER, burst_ogc_fid INTEGER)"
+        )
+        con.executemany(
+            "INSERT INTO frames_bursts VALUES (?, ?, ?)",
+            zip(
+                df_frame_to_burst_id.index.tolist(),
+                df_frame_to_burst_id["frame_fid"].tolist(),
+                df_frame_to_burst_id["burst_ogc_fid"].tolist(),
+            ),
+        )
+        # Covering (burst, frame) index: the burst -> frame lookups (and the
+        # ordered scan in `update_burst_epsg`) never touch the table itself
         con.execute(
             "CREATE INDEX IF NOT EXISTS idx_frames_bursts_burst_ogc_fid ON"
-            " frames_bursts (burst_ogc_fid)"
+            " frames_bursts (burst_ogc_fid, frame_fid)"
         )
         con.execute(
             "CREATE INDEX IF NOT EXISTS idx_frames_bursts_frame_fid ON frames_bursts"
@@ -119,144 +240,101 @@ def make_frame_to_burst_table(outfile: str, df_frame_to_burst_id: pd.DataFrame):
         )
 
 
-def make_frame_table(outfile: str):
-    """Create the frames table and indexes."""
-    with sqlite3.connect(outfile) as con:
-        _setup_spatialite_con(con)
-        con.execute(
-            "CREATE TABLE frames (fid INTEGER PRIMARY KEY, epsg INTEGER, "
-            "is_land INTEGER, is_north_america INTEGER)"
-        )
-        # https://groups.google.com/g/spatialite-users/c/XcWvAk7vg0c
-        # should add geom after the table is created
-        # table_name , geometry_column_name , geometry_type , with_z , with_m , srs_id
-        con.execute(
-            "SELECT gpkgAddGeometryColumn('frames', 'geom', 'MULTIPOLYGON', 2, 0,"
-            " 4326);"
-        )
+def make_frame_table(
+    df_burst: gpd.GeoDataFrame, df_frame_to_burst_id: pd.DataFrame
+) -> gpd.GeoDataFrame:
+    """Create the frames GeoDataFrame, aggregating the bursts of each frame.
 
-        # Aggregates burst geometries for each frame into one
-        con.execute(
-            """INSERT INTO frames(fid, is_land, geom)
-            SELECT fb.frame_fid as fid,
-                    fb.is_land,
-                    ST_UnaryUnion(ST_Collect(geom)) as geom
-            FROM burst_id_map b
-            JOIN
-                frames_bursts fb
-                ON b.ogc_fid = fb.burst_ogc_fid
-            GROUP BY 1;
-        """
-        )
-        logger.info("Creating indexes and spatial index...")
-        con.execute("CREATE INDEX IF NOT EXISTS idx_frames_fid ON frames (fid)")
-        con.execute("SELECT gpkgAddSpatialIndex('frames', 'geom') ;")
-        # Extra thing so that QGIS recognizes "frames" better
-        con.execute(
-            "UPDATE gpkg_geometry_columns SET geometry_type_name = 'MULTIPOLYGON';"
-        )
-        # Set the relative_orbit_number as the most common value for each frame
-        con.execute("ALTER TABLE frames ADD COLUMN relative_orbit_number INTEGER;")
-        con.execute(
-            """WITH frame_tracks AS (
-                SELECT f.fid,
-                    CAST(ROUND(AVG(b.relative_orbit_number))
-                         AS INTEGER) AS relative_orbit_number
-                FROM frames f
-                JOIN frames_bursts fb ON f.fid = fb.frame_fid
-                JOIN burst_id_map b ON fb.burst_ogc_fid = b.ogc_fid
-                GROUP BY 1
-            ) UPDATE frames
-            SET relative_orbit_number = frame_tracks.relative_orbit_number
-            FROM frame_tracks
-            WHERE frames.fid = frame_tracks.fid;
-            """
+    The `epsg` and `is_north_america` columns are placeholders to compute later.
+    """
+    # Look up the bursts making up each frame
+    burst_idxs = pd.Index(df_burst["OGC_FID"]).get_indexer(
+        df_frame_to_burst_id["burst_ogc_fid"]
+    )
+    # Like an INNER JOIN, drop the IDs with no burst (`get_indexer` gives -1, which
+    # would otherwise index the last burst): the final simple frame slice can
+    # extend past the last burst
+    is_matched = burst_idxs >= 0
+    df_frame_to_burst_id = df_frame_to_burst_id[is_matched]
+    burst_idxs = burst_idxs[is_matched]
+    frame_fids = df_frame_to_burst_id["frame_fid"].to_numpy()
+    fids, geoms = _union_groups(df_burst.geometry.to_numpy()[burst_idxs], frame_fids)
+    # Store every frame as a MultiPolygon, including those with one part
+    parts, part_idxs = shapely.get_parts(geoms, return_index=True)
+    geoms = shapely.multipolygons(parts, indices=part_idxs)
+
+    df_attrs = (
+        pd.DataFrame(
+            {
+                "fid": frame_fids,
+                "is_land": df_frame_to_burst_id["is_land"].to_numpy(),
+                "relative_orbit_number": (
+                    df_burst["relative_orbit_number"].to_numpy()[burst_idxs]
+                ),
+                "orbit_pass": df_burst["orbit_pass"].to_numpy()[burst_idxs],
+            }
         )
-        # Set the orbit_pass as the value from the first burst
-        con.execute("ALTER TABLE frames ADD COLUMN orbit_pass TEXT;")
-        con.execute(
-            """WITH op AS
-                (SELECT f.fid,
-                        b.orbit_pass
-                FROM frames f
-                JOIN frames_bursts fb ON f.fid = fb.frame_fid
-                JOIN burst_id_map b ON fb.burst_ogc_fid = b.ogc_fid),
-            frame_orbits AS (
-                SELECT fid,
-                    FIRST_VALUE(orbit_pass) OVER (PARTITION BY fid) AS orbit_pass
-                FROM op
-                GROUP BY fid)
-            UPDATE frames SET orbit_pass = frame_orbits.orbit_pass
-            FROM frame_orbits
-            WHERE frames.fid = frame_orbits.fid;
-            """
+        .groupby("fid", sort=True)
+        .agg(
+            is_land=("is_land", "max"),
+            relative_orbit_number=("relative_orbit_number", "mean"),
+            orbit_pass=("orbit_pass", "min"),
         )
-
-        # Drop the is_land from the frames_bursts table
-        con.execute("ALTER TABLE frames_bursts DROP COLUMN is_land;")
+    )
+    return gpd.GeoDataFrame(
+        {
+            "fid": fids,
+            "epsg": 0,
+            "is_land": df_attrs["is_land"].to_numpy().astype(int),
+            "is_north_america": False,
+            # Set the relative_orbit_number as the most common value for each frame
+            # (rounding halves up, like SQL's ROUND, rather than to even)
+            "relative_orbit_number": (
+                np.floor(df_attrs["relative_orbit_number"].to_numpy() + 0.5).astype(int)
+            ),
+            # A frame is within one track, so all its bursts share the orbit_pass
+            "orbit_pass": df_attrs["orbit_pass"].to_numpy(),
+        },
+        geometry=gpd.GeoSeries(geoms, crs=df_burst.crs),
+    ).rename_geometry("geom")
 
 
-def get_epsg_codes(df: gpd.GeoDataFrame):
+def get_epsg_codes(df: gpd.GeoDataFrame, tree: STRtree | None = None):
     """Get the EPSG codes for all non-antimeridian polygons in a GeoDataFrame.
 
-    Uses the UTM library to account for the oddities of the Zones near Norway [1]_.
+    Accounts for the oddities of the UTM Zones near Norway and Svalbard [1]_.
+    An STRtree already built on `df.geometry` can be passed as `tree`.
 
     References
     ----------
     .. _[1]: http://www.jaworski.ca/utmzones.htm
 
     """
+    geoms = df.geometry.values
 
-    def _is_on_antimeridian(geom):
-        return geom.geom_type == "MultiPolygon" and len(geom.geoms) > 1
-
-    epsgs = np.zeros(len(df), dtype=int)
-
-    # do the antimeridian frames first
-    am_idxs = df.geometry.map(_is_on_antimeridian).values
-    epsgs[am_idxs] = df[am_idxs].geometry.map(antimeridian_epsg)
-
-    # everything else
-    # get the x, y (lon, lat) coords of all other rows
-    other_coords = np.array(
-        df[~am_idxs].geometry.map(lambda g: next(iter(g.centroid.coords))).tolist()
+    # the antimeridian frames are split into multiple polygons
+    am_idxs = (shapely.get_type_id(geoms) == GeometryType.MULTIPOLYGON) & (
+        shapely.get_num_geometries(geoms) > 1
     )
-    xs, ys = other_coords.T
-    ys_full_size = np.ones(len(epsgs)) * np.nan
-    ys_full_size[~am_idxs] = ys
+    am_epsgs = np.zeros(len(df), dtype=int)
+    am_epsgs[am_idxs] = _get_antimeridian_epsgs(geoms[am_idxs])
 
-    idxs = np.logical_and.reduce((~am_idxs, ys_full_size > NORTH_THRESHOLD))
-    epsgs[idxs] = NORTH_EPSG
-
-    idxs = np.logical_and.reduce((~am_idxs, ys_full_size < SOUTH_THRESHOLD))
-    epsgs[idxs] = SOUTH_EPSG
-
-    utm_idxs = np.logical_and(ys < NORTH_THRESHOLD, ys > SOUTH_THRESHOLD)
-    north_idxs = ys[utm_idxs] > 0
-
-    # North hemisphere
-    zones_north = [
-        utm.from_latlon(y, x)[2]
-        for (y, x) in zip(ys[utm_idxs][north_idxs], xs[utm_idxs][north_idxs])
-    ]
-    idxs = np.logical_and.reduce(
-        (~am_idxs, ys_full_size < NORTH_THRESHOLD, ys_full_size > 0)
-    )
-    epsgs[idxs] = 32600 + np.array(zones_north)
-
-    # South hemisphere
-    zones_south = [
-        utm.from_latlon(y, x)[2]
-        for (y, x) in zip(ys[utm_idxs][~north_idxs], xs[utm_idxs][~north_idxs])
-    ]
-    idxs = np.logical_and.reduce(
-        (~am_idxs, ys_full_size > SOUTH_THRESHOLD, ys_full_size < 0)
+    # get the x, y (lon, lat) coords of all rows
+    # (`get_x`/`get_y` keep one value per row, unlike `get_coordinates`)
+    centroids = shapely.centroid(geoms)
+    xs, ys = shapely.get_x(centroids), shapely.get_y(centroids)
+    # Northern hemisphere = 326XX, southern is 327XX
+    utm_epsgs = np.where(ys > 0, 32600, 32700) + _get_utm_zones(xs, ys)
+    # Pick the first matching case for each frame, in one vectorized pass
+    epsgs = np.select(
+        [am_idxs, ys > NORTH_THRESHOLD, ys < SOUTH_THRESHOLD],
+        [am_epsgs, NORTH_EPSG, SOUTH_EPSG],
+        default=utm_epsgs,
     )
-    epsgs[idxs] = 32700 + np.array(zones_south)
 
     # Set all Greenland frames to EPSG:3413
     geom_greenland = get_greenland_shape()
-    is_in_greenland = get_intersect_indicator(df, geom_greenland)
+    is_in_greenland = get_intersect_indicator(df, geom_greenland, tree=tree)
     logger.info(
         f"{is_in_greenland.sum()} frames are in Greenland. Setting to EPSG:{NORTH_EPSG}"
     )
@@ -265,80 +343,108 @@ def get_epsg_codes(df: gpd.GeoDataFrame):
     return epsgs
 
 
-def antimeridian_epsg(mp):
-    """Calculate the EPSG of multipolygons along the antimeridian.
+def _get_utm_zones(lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    """Get the UTM zone numbers for arrays of longitudes and latitudes.
+
+    Matches `utm.from_latlon`, including the exceptions for Norway and Svalbard.
+    """
+    zones = np.floor((lons + 180) / 6).astype(int) % 60 + 1
+    # Southwest Norway is widened to zone 32
+    zones[(lats >= 56) & (lats < 64) & (lons >= 3) & (lons < 12)] = 32
+    # Svalbard only uses the odd zones 31, 33, 35, 37
+    is_svalbard = (lats >= 72) & (lats <= 84) & (lons >= 0) & (lons < 42)
+    zones[is_svalbard] = np.select(
+        [lons[is_svalbard] < 9, lons[is_svalbard] < 21, lons[is_svalbard] < 33],
+        [31, 33, 35],
+        default=37,
+    )
+    return zones
+
+
+def _get_antimeridian_epsgs(geoms: np.ndarray) -> np.ndarray:
+    """Calculate the EPSG codes of an array of multipolygons along the antimeridian.
 
     Parameters
     ----------
-    mp : shapely.geometry.MultiPolygon
-        The multipolygon to calculate the EPSG for.
+    geoms : np.ndarray[shapely.geometry.MultiPolygon]
+        The multipolygons to calculate the EPSG for.
 
     Returns
     -------
-    epsg : int
-        The EPSG code for the multipolygon.
+    epsgs : np.ndarray[int]
+        The EPSG code for each multipolygon.
 
     Notes
     -----
     The EPSG code is calculated by taking the weighted average of the centroid of the
     polygons in the multipolygon. The centroid is weighted by the area of the polygon.
     The centroid is shifted by 360 degrees if it is in the western hemisphere.
+    The parts of all multipolygons are processed at once.
 
     """
-    y_c = mp.centroid.y
-    # check north/south pole cases
-    if y_c >= NORTH_THRESHOLD:
-        return NORTH_EPSG
-    elif y_c <= SOUTH_THRESHOLD:
-        return SOUTH_EPSG
-
-    # otherwise, do the weighted average of the shifted polygons to get the centroid
-    A = 0
-    x_weighted = 0
-    # might have 2 or 3 polygons
-    for g in mp.geoms:
-        A += g.area
-        if g.centroid.x < 0:
-            g_shifted = translate(g, xoff=360)
-            x_weighted += g_shifted.centroid.x * g.area
-        else:
-            x_weighted += g.centroid.x * g.area
-    x_c = x_weighted / A
+    # Frames entirely past a polar threshold don't need any centroids
+    bounds = shapely.bounds(geoms)
+    is_north = bounds[:, 1] >= NORTH_THRESHOLD
+    is_south = bounds[:, 3] <= SOUTH_THRESHOLD
+    epsgs = np.where(is_north, NORTH_EPSG, SOUTH_EPSG)
+    rest = ~(is_north | is_south)
+    epsgs[rest] = _get_straddling_antimeridian_epsgs(geoms[rest])
+    return epsgs
+
+
+def _get_straddling_antimeridian_epsgs(geoms: np.ndarray) -> np.ndarray:
+    """Calculate the EPSG codes of antimeridian frames not entirely in a polar zone."""
+    y_c = shapely.get_y(shapely.centroid(geoms))
+
+    # do the weighted average of the shifted polygons to get the centroid
+    # (each might have 2 or 3 polygons)
+    parts, idxs = shapely.get_parts(geoms, return_index=True)
+    areas = shapely.area(parts)
+    x_parts = shapely.get_x(shapely.centroid(parts))
+    x_parts = np.where(x_parts < 0, x_parts + 360, x_parts)
+    n = len(geoms)
+    x_weighted = np.bincount(idxs, weights=x_parts * areas, minlength=n)
+    x_c = x_weighted / np.bincount(idxs, weights=areas, minlength=n)
 
     # Northern hemisphere = 326XX, southern is 327XX
-    base = 32600 if y_c > 0 else 32700
+    base = np.where(y_c > 0, 32600, 32700)
     # EPSG increases negative to positive (west to east)
     # 32601 is at longitude -179 (which 181 after shifting +360)
-    zone_addition = 1 if x_c > 180 else 60
-    return base + zone_addition
+    epsgs = base + np.where(x_c > 180, 1, 60)
+    # check north/south pole cases
+    epsgs[y_c >= NORTH_THRESHOLD] = NORTH_EPSG
+    epsgs[y_c <= SOUTH_THRESHOLD] = SOUTH_EPSG
+    return epsgs
 
 
 def update_burst_epsg(outfile):
     """Update the EPSG of each burst to match the EPSG of the frame it is in."""
-    with sqlite3.connect(outfile) as con:
-        _setup_spatialite_con(con)
+    with _spatialite_connection(outfile) as con:
         # add index
         con.execute(
             "CREATE INDEX IF NOT EXISTS idx_burst_id_map_burst_id_jpl ON burst_id_map"
             " (burst_id_jpl)"
         )
+        # Gather the index statistics so the planner scans the covering index
+        con.execute("ANALYZE;")
         # Set the EPSG on every burst from the frames
         logger.info("Updating burst EPSGs to match frames...")
-        sql = """WITH burst_epsgs AS (
-                    SELECT b.OGC_FID,
-                        f.epsg
-                    FROM burst_id_map b
-                    JOIN frames_bursts fb
-                    ON b.OGC_FID = fb.burst_ogc_fid
-                    JOIN frames f
-                    ON fb.frame_fid = f.fid
-                )
-                UPDATE burst_id_map
-                SET epsg = burst_epsgs.epsg
-                FROM burst_epsgs
-                WHERE burst_id_map.OGC_FID = burst_epsgs.OGC_FID;
-        """
-        con.execute(sql)
+        # Materialize the join once, then update each burst by its primary key,
+        # rather than the correlated UPDATE ... FROM over the 3-table join
+        df_epsgs = pd.read_sql_query(
+            """SELECT fb.burst_ogc_fid, f.epsg
+            FROM frames_bursts fb
+            JOIN frames f ON fb.frame_fid = f.fid
+            ORDER BY fb.burst_ogc_fid, fb.frame_fid;
+            """,
+            con,
+        )
+        # Bursts in two frames take the EPSG of the first one
+        df_epsgs = df_epsgs.drop_duplicates(subset="burst_ogc_fid")
+        con.executemany(
+            "UPDATE burst_id_map SET epsg = ? WHERE OGC_FID = ?",
+            zip(df_epsgs["epsg"].tolist(), df_epsgs["burst_ogc_fid"].tolist()),
+        )
 
 
 def add_gpkg_spatial_ref_sys(outfile):
@@ -346,13 +452,16 @@ def add_gpkg_spatial_ref_sys(outfile):
     north_hemi_utm = list(range(32601, 32661))
     south_hemi_utm = list(range(32701, 32761))
     epsgs = [SOUTH_EPSG, NORTH_EPSG, 4326, *north_hemi_utm, *south_hemi_utm]
-    with sqlite3.connect(outfile) as con:
-        _setup_spatialite_con(con)
-        sql = "SELECT gpkgInsertEpsgSRID({epsg});"
+    with _spatialite_connection(outfile) as con:
+        # The inserts happen inside a SELECT, which doesn't start a transaction:
+        # begin one so they aren't each committed separately.
+        # (A failing statement only rolls back itself, not the whole batch.)
+        con.execute("BEGIN;")
+        sql = "SELECT gpkgInsertEpsgSRID(?);"
         for epsg in tqdm(epsgs):
             # Add EPSGs to table, ignoring already-exists errors.
             with contextlib.suppress(sqlite3.OperationalError, sqlite3.IntegrityError):
-                con.execute(sql.format(epsg=epsg))
+                con.execute(sql, (epsg,))
 
         # Fix the gpkg_spatial_ref_sys table for missing UTM zone 32760
         # https://www.gaia-gis.it/fossil/libspatialite/tktview/8b6910dbbb2180026af54a5cc5aac107fb1d62ad?plaintext
@@ -387,8 +496,9 @@ def add_gpkg_spatial_ref_sys(outfile):
         with contextlib.suppress(sqlite3.OperationalError, sqlite3.IntegrityError):
             con.execute(sql, (UTM_32760_DEF,))
 
-        # More the entries from gpkg_spatial_ref_sys to spatial_ref_sys
-        # so we can use the `ST_Transform` function
+        # Copy the entries from gpkg_spatial_ref_sys to spatial_ref_sys, so that
+        # SpatiaLite's `ST_Transform` works on the output file for its users
+        # (the UTM bounding boxes here are computed with pyproj)
         con.execute("DROP TABLE IF EXISTS spatial_ref_sys;")
         sql = """
         CREATE TABLE spatial_ref_sys (
@@ -412,48 +522,62 @@ def add_gpkg_spatial_ref_sys(outfile):
         con.execute(sql)
 
 
+@lru_cache(maxsize=256)
+def _get_utm_transformer(epsg: int) -> Transformer:
+    """Get a (cached) lon/lat to `epsg` transformer.
+
+    The cache shares them across the `burst_id_map` and `frames` passes of
+    `save_utm_bounding_boxes`, which use the same EPSGs.
+    """
+    return Transformer.from_crs(4326, epsg, always_xy=True)
+
+
 def save_utm_bounding_boxes(
     outfile, *, table: str, id_column: str, margin: float, snap: float
 ):
     """Save the bounding boxes of each burst in UTM coordinates."""
     logger.info("Saving UTM bounding boxes...")
     try:
-        with sqlite3.connect(outfile) as con:
+        with _spatialite_connection(outfile) as con:
             for col in ["xmin", "ymin", "xmax", "ymax"]:
                 con.execute(f"ALTER TABLE {table} ADD COLUMN {col} INTEGER;")
     except sqlite3.OperationalError:
         # Already exists
         pass
 
+    # `id_column` is the primary key, so GDAL reads it as the FID
+    gdf = gpd.read_file(
+        outfile, layer=table, columns=["epsg"], fid_as_index=True, engine="pyogrio"
+    )
+    geoms = gdf.geometry.to_numpy()
+    epsgs = gdf["epsg"].to_numpy()
+
     # - Transform the geometry from 4326 (lat/lon) to the UTM EPSG
-    # - get the bounding box using "envelope" as the min/max coords
-    sql = f"""
-WITH transformed(g, {id_column}) AS
-  (SELECT ST_Envelope(ST_Transform(geom, CAST(epsg as INTEGER))) g,
-          {id_column}
-   FROM {table}
-   WHERE epsg != 0 )
-UPDATE {table}
-SET (xmin,
-     ymin,
-     xmax,
-     ymax) = (bboxes.xmin,
-              bboxes.ymin,
-              bboxes.xmax,
-              bboxes.ymax)
-FROM
-  (SELECT {id_column},
-          FLOOR((ST_MinX(g) - {margin}) / {snap:.1f}) * {snap:.1f} AS xmin,
-          FLOOR((ST_MinY(g) - {margin}) / {snap:.1f}) * {snap:.1f} AS ymin,
-          CEIL((ST_MaxX(g) + {margin}) / {snap:.1f}) * {snap:.1f} AS xmax,
-          CEIL((ST_MaxY(g) + {margin}) / {snap:.1f}) * {snap:.1f} AS ymax
-   FROM transformed) AS bboxes
-WHERE {table}.{id_column} = bboxes.{id_column} ;
-    """
-    logger.info(sql)
-    with sqlite3.connect(outfile) as con:
-        _setup_spatialite_con(con)
-        con.execute(sql)
+    #   (one PROJ transformer per EPSG, over all vertices of its geometries)
+    # - get the bounding box as the min/max coords
+    bounds = np.full((len(gdf), 4), np.nan)
+    for epsg in np.unique(epsgs[epsgs != 0]):
+        idxs = epsgs == epsg
+        transformer = _get_utm_transformer(int(epsg))
+        # (the indexing makes a new array, so setting its coordinates is safe)
+        geoms_utm = geoms[idxs]
+        lons, lats = shapely.get_coordinates(geoms_utm).T
+        xs, ys = transformer.transform(lons, lats)
+        shapely.set_coordinates(geoms_utm, np.column_stack([xs, ys]))
+        bounds[idxs] = shapely.bounds(geoms_utm)
+
+    # Snap outward, and store the coordinates as integers (~40% smaller than REAL)
+    valid = epsgs != 0
+    snapped = np.empty((valid.sum(), 4), dtype=np.int32)
+    snapped[:, :2] = np.floor((bounds[valid, :2] - margin) / snap) * snap
+    snapped[:, 2:] = np.ceil((bounds[valid, 2:] + margin) / snap) * snap
+    rows = zip(*snapped.T.tolist(), gdf.index[valid].tolist())
+    with _spatialite_connection(outfile) as con:
+        con.executemany(
+            f"UPDATE {table} SET xmin = ?, ymin = ?, xmax = ?, ymax = ?"
+            f" WHERE {id_column} = ?",
+            rows,
+        )
 
 
 def make_minimal_db(db_path, df_frame_to_burst_id, output_path):
@@ -462,20 +586,21 @@ def make_minimal_db(db_path, df_frame_to_burst_id, output_path):
     Containing only the following columns:
         OGC_FID, burst_id_jpl, epsg, xmin, ymin, ymax, ymax
     """
-    with sqlite3.connect(db_path) as con:
-        df = pd.read_sql_query(
-            "SELECT OGC_FID, burst_id_jpl, epsg, xmin, ymin, xmax, ymax FROM"
-            " burst_id_map",
-            con,
-        )
-    # Make sure snapped coordinates as integers (~40% smaller than REAL)
-    df["xmin"] = df["xmin"].astype(int)
-    df["ymin"] = df["ymin"].astype(int)
-    df["xmax"] = df["xmax"].astype(int)
-    df["ymax"] = df["ymax"].astype(int)
-
-    with sqlite3.connect(output_path) as con:
-        df.to_sql("burst_id_map", con, if_exists="replace", index=False)
+    columns = "OGC_FID, burst_id_jpl, epsg, xmin, ymin, xmax, ymax"
+    # Copy the table within SQLite, rather than round-tripping it through pandas
+    con = sqlite3.connect(output_path)
+    try:
+        with con:
+            con.execute("ATTACH DATABASE ? AS src", (str(db_path),))
+            con.execute("DROP TABLE IF EXISTS main.burst_id_map;")
+            con.execute(
+                f"CREATE TABLE main.burst_id_map AS SELECT {columns} FROM"
+                " src.burst_id_map"
+            )
+        # (The burst/frame lists for the JSON output are still built in pandas)
+        df = pd.read_sql_query(f"SELECT {columns} FROM main.burst_id_map", con)
+    finally:
+        con.close()
 
     # Make a version which has the list of frames each burst belongs to
     df_burst_to_frames = _get_burst_to_frame_list(df_frame_to_burst_id)
@@ -488,11 +613,13 @@ def make_minimal_db(db_path, df_frame_to_burst_id, output_path):
 
 def make_burst_to_frame_json(df, output_path: str, metadata: dict):
     """Write JSON file mapping: burst IDs to the frame IDs that contain each burst."""
-    data_dict = (
-        df.set_index("burst_id_jpl")[["frame_fid"]]
-        .rename(columns={"frame_fid": "frame_ids"})
-        .to_dict(orient="index")
-    )
+    # Build the dict directly, skipping pandas' generic `to_dict` machinery
+    data_dict = {
+        burst_id: {"frame_ids": frame_ids}
+        for burst_id, frame_ids in zip(
+            df["burst_id_jpl"].tolist(), df["frame_fid"].tolist()
+        )
+    }
     # Format:  {'t001_000001_iw1': [1], ...}
     dict_out = {"data": data_dict, "metadata": metadata}
     write_zipped_json(output_path, dict_out)
@@ -523,7 +650,12 @@ def make_frame_to_burst_json(db_path: str, output_path: str, metadata: dict):
     df_frame_to_burst.burst_ids = df_frame_to_burst.burst_ids.str.split(",")
     df_frame_to_burst.is_land = df_frame_to_burst.is_land.astype(bool)
     df_frame_to_burst.is_north_america = df_frame_to_burst.is_north_america.astype(bool)
-    data_dict = df_frame_to_burst.set_index("frame_id").to_dict(orient="index")
+    frame_ids = df_frame_to_burst.pop("frame_id").tolist()
+    columns = df_frame_to_burst.columns.tolist()
+    rows = zip(*(df_frame_to_burst[col].tolist() for col in columns))
+    data_dict = {
+        frame_id: dict(zip(columns, row)) for frame_id, row in zip(frame_ids, rows)
+    }
     dict_out = {"data": data_dict, "metadata": metadata}
 
     write_zipped_json(output_path, dict_out)
@@ -544,10 +676,16 @@ def _get_burst_to_frame_list(df_frame_to_burst_id):
     28                  [2]
 
     """
-    return (
-        df_frame_to_burst_id[["burst_ogc_fid", "frame_fid"]]
-        .groupby("burst_ogc_fid")
-        .agg(list)
+    # Sort once and split at the group boundaries, rather than `groupby.agg(list)`
+    burst_fids = df_frame_to_burst_id["burst_ogc_fid"].to_numpy()
+    order = np.argsort(burst_fids, kind="stable")
+    keys, starts = np.unique(burst_fids[order], return_index=True)
+    frame_fids = df_frame_to_burst_id["frame_fid"].to_numpy()[order].tolist()
+    bounds = [*starts.tolist(), len(frame_fids)]
+    groups = [frame_fids[i:j] for i, j in zip(bounds[:-1], bounds[1:])]
+    return pd.DataFrame(
+        {"frame_fid": groups},
+        index=pd.Index(keys, name="burst_ogc_fid"),
     )
 
 
@@ -646,23 +784,45 @@ def create(
     logger.info("Loading burst data...")
     sql = "SELECT * FROM burst_id_map"
     with sqlite3.connect(esa_db_path) as con:
+        # Read the pages through mmap, rather than copying them via the page cache
+        con.execute("PRAGMA mmap_size = 30000000000;")
+        con.execute("PRAGMA cache_size = -524288;")
+        con.execute("PRAGMA temp_store = MEMORY;")
         df_burst = gpd.GeoDataFrame.from_postgis(
             sql, con, geom_col="GEOMETRY", crs="EPSG:4326"
         ).rename_geometry("geom")
+    # Shrink the columns read as int64/object for the in-memory work: the tracks
+    # are 1-175, the burst IDs are < 400,000, and there are only 3 subswath names
+    # (`_ESA_BURST_DTYPES` restores them for the output schema)
+    df_burst = df_burst.astype(
+        {
+            "relative_orbit_number": np.int16,
+            "burst_id": np.int32,
+            "subswath_name": "category",
+        }
+    )
 
     logger.info("Forming string JPL id")
     jpl_ids = make_jpl_burst_id(df_burst)
-    df_burst.loc[:, "burst_id_jpl"] = jpl_ids
+    df_burst["burst_id_jpl"] = jpl_ids
     # placeholder to compute later
-    df_burst.loc[:, "epsg"] = 0
+    df_burst["epsg"] = 0
 
     geom_north_america = get_opera_na_shape()
     is_in_na = get_intersect_indicator(df_burst, geom_north_america)
-    df_burst.loc[:, "is_north_america"] = is_in_na
+    df_burst["is_north_america"] = is_in_na
     # Start the outfile with the ESA database contents
     logger.info("Saving initial version of `burst_id_map` table")
-    df_burst.set_index("OGC_FID").to_file(
-        outfile, driver="GPKG", layer="burst_id_map", index=False
+    # Write through pyogrio's Arrow path in columnar batches (not feature by feature)
+    # (with the original dtypes, so the GPKG columns stay INTEGER rather than the
+    # SMALLINT/MEDIUMINT that int16/int32 would be written as)
+    df_burst.set_index("OGC_FID").astype(_ESA_BURST_DTYPES).to_file(
+        outfile,
+        driver="GPKG",
+        layer="burst_id_map",
+        index=False,
+        engine="pyogrio",
+        use_arrow=True,
     )
     # Adjust the primary key so it still matches original OGC_FID
     logger.info("Renaming index column from 'fid' to 'OGC_FID'")
@@ -693,23 +853,29 @@ def create(
 
     # make the "frames" table
     logger.info("Making frames table by aggregating burst geometries...")
-    make_frame_table(outfile)
-    df_frames = gpd.read_file(outfile, layer="frames")
+    df_frames = make_frame_table(df_burst, df_frame_to_burst_id)
+
+    # Build one tree for the Greenland and North America queries on the frames
+    frames_tree = STRtree(df_frames.geometry.values)
 
     logger.info("Computing EPSG codes for each frame...")
-    epsgs = get_epsg_codes(df_frames)
-    df_frames.loc[:, "epsg"] = pd.to_numeric(epsgs, errors="coerce")
+    df_frames["epsg"] = get_epsg_codes(df_frames, tree=frames_tree)
 
     # Mark the ones in north america in the OPERA region of interest
-    is_in_north_america = get_intersect_indicator(df_frames, geom_north_america)
-    df_frames.loc[:, "is_north_america"] = is_in_north_america
+    is_in_north_america = get_intersect_indicator(
+        df_frames, geom_north_america, tree=frames_tree
+    )
+    df_frames["is_north_america"] = is_in_north_america
 
     logger.info("Final number of frames: %s", len(df_frames))
     logger.info("Number intersecting land: %s", is_in_land.sum())
     logger.info("Number in North America: %s", is_in_north_america.sum())
     logger.info("Saving frames...")
-    df_frames["epsg"] = df_frames["epsg"].astype("int")
-    df_frames.to_file(outfile, driver="GPKG", layer="frames")
+    # Write the complete layer once: GDAL builds the spatial index in one pass
+    # (the "fid" column becomes the GeoPackage feature ID)
+    df_frames.to_file(
+        outfile, driver="GPKG", layer="frames", engine="pyogrio", use_arrow=True
+    )
 
     update_burst_epsg(outfile)
 
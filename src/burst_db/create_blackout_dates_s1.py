@@ -223,7 +223,7 @@ def gdf_to_blackout_json(input_file: Path | str) -> dict:
 
     """
     # Read the GeoJSON file
-    gdf = gpd.read_file(input_file)
+    gdf = gpd.read_file(input_file, engine="pyogrio")
 
     blackout_dates: dict[str, list[list[str]]] = {}
 
@@ -44,17 +44,29 @@ def create_frame_to_burst_mapping(
         )
 
     # Create the frame IDs mapping to burst_id
-    # (frame_id, OGC_FID)
-    frame_ogc_fid_tuples = []
-    for frame_id, (start_idx, end_idx, is_land) in enumerate(
-        cumulative_slice_idxs, start=1
-    ):
-        for burst_id in range(start_idx + 1, end_idx + 1):
-            for ogc_fid in range(1 + 3 * (burst_id - 1), 4 + 3 * (burst_id - 1)):
-                frame_ogc_fid_tuples.append((frame_id, ogc_fid, is_land))
+    # (frame_id, OGC_FID), as int32 columns (the ~1.1M OGC_FIDs fit easily)
+    # (`reshape` keeps 3 columns when there are no slices at all)
+    start_idxs, end_idxs, is_land = (
+        np.array(cumulative_slice_idxs, dtype=np.int64).reshape(-1, 3).T
+    )
+    n_bursts = (end_idxs - start_idxs).astype(np.int32)
+    # The (0-based) index of every burst in each frame, in order
+    offsets = np.arange(n_bursts.sum(), dtype=np.int32) - np.repeat(
+        np.cumsum(n_bursts, dtype=np.int32) - n_bursts, n_bursts
+    )
+    burst_idxs = np.repeat(start_idxs.astype(np.int32), n_bursts) + offsets
+    # Each burst ID has 3 rows, IW1,2,3, with OGC_FIDs 3 * idx + (1, 2, 3)
+    ogc_fids = 3 * np.repeat(burst_idxs, 3) + np.tile(
+        np.array([1, 2, 3], dtype=np.int32), len(burst_idxs)
+    )
+    frame_fids = np.arange(1, len(n_bursts) + 1, dtype=np.int32)
 
     df_frame_to_burst_id = pd.DataFrame(
-        frame_ogc_fid_tuples, columns=["frame_fid", "burst_ogc_fid", "is_land"]
+        {
+            "frame_fid": np.repeat(frame_fids, 3 * n_bursts),
+            "burst_ogc_fid": ogc_fids,
+            "is_land": np.repeat(is_land.astype(bool), 3 * n_bursts),
+        }
     )
     return df_frame_to_burst_id
 
@@ -235,20 +247,10 @@ def create_frame_slices(is_land_indicator, min_frame=MIN_FRAME) -> list[FrameSli
                 indicator[ii - min_frame // 2 : ii + min_frame // 2 + 1] = True
             # loop will break when we didn't adjust any water sequences
 
-    consecutive_land_frames: Counter[int] = Counter()
-    consecutive_water_frames: Counter[int] = Counter()
-    frame_slices: list[FrameSlice] = []
-    ii, i_prev = 0, 0
-    for is_land, cur_indicators in groupby(indicator):
-        n_frames = len(list(cur_indicators))
-        i_prev = ii
-        ii += n_frames
-        frame_slices.append(FrameSlice(i_prev, ii, bool(is_land)))
-
-        if is_land:
-            consecutive_land_frames[n_frames] += 1
-        else:
-            consecutive_water_frames[n_frames] += 1
+    # Split the final indicator into its runs of land/water
+    frame_slices, run_lengths, run_is_land = _run_length_slices(indicator)
+    consecutive_land_frames = Counter(run_lengths[run_is_land].tolist())
+    consecutive_water_frames = Counter(run_lengths[~run_is_land].tolist())
 
     print("Number of occurrences with consecutive land bursts:")
     print(sorted(consecutive_land_frames.items())[:5], end=",... ")
@@ -258,3 +260,24 @@ def create_frame_slices(is_land_indicator, min_frame=MIN_FRAME) -> list[FrameSli
     print(sorted(consecutive_water_frames.items())[-5:])
 
     return frame_slices
+
+
+def _run_length_slices(
+    indicator: ArrayLike,
+) -> tuple[list[FrameSlice], np.ndarray, np.ndarray]:
+    """Run-length encode a boolean `indicator` into `FrameSlice`s.
+
+    Returns the slices, along with the length and value of each run.
+    """
+    indicator = np.asarray(indicator, dtype=bool)
+    if len(indicator) == 0:
+        return [], np.array([], dtype=int), np.array([], dtype=bool)
+    change_idxs = np.flatnonzero(indicator[1:] != indicator[:-1]) + 1
+    start_idxs = np.concatenate([[0], change_idxs])
+    end_idxs = np.concatenate([change_idxs, [len(indicator)]])
+    run_is_land = indicator[start_idxs]
+    frame_slices = [
+        FrameSlice(*row)
+        for row in zip(start_idxs.tolist(), end_idxs.tolist(), run_is_land.tolist())
+    ]
+    return frame_slices, end_idxs - start_idxs, run_is_land
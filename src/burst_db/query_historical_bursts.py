@@ -3,7 +3,7 @@ from __future__ import annotations
 import csv
 import sqlite3
 from datetime import date, datetime
-from functools import partial
+from functools import lru_cache, partial
 from pathlib import Path
 from typing import Any, Callable, Optional, Sequence
 
@@ -17,6 +17,13 @@ FRAME_TO_BURST_JSON_FILE = Path(
 DB_PATH = Path("/home/staniewi/dev/coverage-map-s1/global/testing_all_bursts.gpkg")
 
 
+@lru_cache(maxsize=4)
+def _get_frame_to_burst_ids(frame_to_burst_json_file: Path) -> dict[int, list[str]]:
+    """Read the burst IDs of each frame, caching the parsed JSON across calls."""
+    data = read_zipped_json(frame_to_burst_json_file)["data"]
+    return {int(frame_id): d.get("burst_ids", []) for frame_id, d in data.items()}
+
+
 def _fetch_base(
     frame_ids: list[str],
     row_processor: Callable = lambda row: row,
@@ -30,10 +37,10 @@ def _fetch_base(
     debug: bool = False,
 ) -> list[Any]:
     # Step 1: Parse zipped JSON to get the burst_ids for the given frame_ids
-    data = read_zipped_json(frame_to_burst_json_file)["data"]
+    frame_to_burst_ids = _get_frame_to_burst_ids(frame_to_burst_json_file)
     burst_ids = []
     for frame_id in frame_ids:
-        burst_ids.extend(data.get(f"{int(frame_id)}", {}).get("burst_ids", []))
+        burst_ids.extend(frame_to_burst_ids.get(int(frame_id), []))
 
     # Step 2: De-duplicate the burst_ids
     unique_burst_ids = list(set(burst_ids))
@@ -42,27 +49,35 @@ def _fetch_base(
 
     # Step 3: Connect to the SQLite database and get the relevant granules
     with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        # Load the burst IDs into a temp table to join against, rather than binding
+        # one parameter each (which also hits SQLite's host parameter limit)
+        cursor.execute("CREATE TEMP TABLE _burst_ids (burst_id_jpl TEXT PRIMARY KEY)")
+        cursor.executemany(
+            "INSERT INTO _burst_ids VALUES (?)", [(b,) for b in unique_burst_ids]
+        )
+
         if debug:
             # This adds a callback to print the executed statements to stderr
+            # (after the temp table insert, which would print one per burst ID)
             conn.set_trace_callback(partial(click.echo, err=True))
 
-        cursor = conn.cursor()
-
         query, args = _get_query(
-            unique_burst_ids=unique_burst_ids,
             select_columns=select_columns,
             min_datetime=min_datetime,
             max_datetime=max_datetime,
         )
-        results = cursor.execute(query, args).fetchall()
+        # Stream the rows out in batches, instead of `fetchall` on the full result
+        cursor.arraysize = 1000
+        cursor.execute(query, args)
         writer = csv.writer(output_file)
 
         if headers:
             writer.writerow([c.replace("DISTINCT ", "") for c in select_columns])
-        for row in results:
-            out_row = row_processor(row)
-            writer.writerow([out_row])
-            out.append(out_row)
+        while batch := cursor.fetchmany():
+            out_rows = [row_processor(row) for row in batch]
+            writer.writerows([out_row] for out_row in out_rows)
+            out.extend(out_rows)
     return out
 
 
@@ -186,19 +201,21 @@ def fetch_bursts(
 
 
 def _get_query(
-    unique_burst_ids: Sequence[str],
     select_columns: Sequence[str],
     min_datetime: Optional[datetime] = None,
     max_datetime: Optional[datetime] = None,
 ) -> tuple[str, list]:
-    """Build up the query to run on the full database."""
+    """Build up the query to run on the full database.
+
+    The burst IDs to select are read from the `_burst_ids` temp table.
+    """
     # fid  geom  burst_id_jpl     sensing_time                granule
-    query_base = f"""
+    query_base = """
     FROM bursts
-    WHERE bursts.burst_id_jpl IN ({', '.join(['?']*len(unique_burst_ids))})"""
+    WHERE bursts.burst_id_jpl IN (SELECT burst_id_jpl FROM temp._burst_ids)"""
 
     query = f"SELECT {','.join(select_columns)}" + query_base
-    args: list[str | date] = list(unique_burst_ids)
+    args: list[str | date] = []
     if min_datetime:
         query += "\nAND sensing_time >= ?"
         args += [min_datetime.date()]
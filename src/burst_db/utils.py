@@ -1,27 +1,62 @@
 from __future__ import annotations
 
 import json
+import os
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from itertools import islice
 from pathlib import Path
+from typing import Any, Callable
 
+import numpy as np
 from shapely import box
 
+# Compact separators (no whitespace), and skip the circular reference check,
+# which the plain dicts/lists/scalars being written never need
+_JSON_KWARGS: dict[str, Any] = {"separators": (",", ":"), "check_circular": False}
+
 
 def read_zipped_json(filename: str | Path) -> dict:
     """Read a ".json.zip" file into a dict."""
     with zipfile.ZipFile(filename) as zf:
         bytes_ = zf.read(str(Path(filename).name).replace(".zip", ""))
-        return json.loads(bytes_.decode())
+    # `json.loads` accepts the UTF-8 bytes directly: skip the decoded copy
+    return json.loads(bytes_)
+
 
+def write_zipped_json(
+    json_path: str, dict_out: dict, level: int = 6, batch_size: int = 10_000
+):
+    """Write a JSON dictionary to a sibling compressed ".json.zip" file.
 
-def write_zipped_json(json_path: str, dict_out: dict, level: int = 6):
-    """Write a JSON dictionary to a sibling compressed ".json.zip" file."""
+    The JSON is streamed into the archive: nested dictionaries are encoded
+    `batch_size` items at a time, rather than building the whole string in memory.
+    """
     json_zip_path = str(json_path) + ".zip"
-    with zipfile.ZipFile(
-        json_zip_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=level
-    ) as zf:
-        zf.writestr(json_path, json.dumps(dict_out))
+    with (
+        zipfile.ZipFile(
+            json_zip_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=level
+        ) as zf,
+        zf.open(str(json_path), "w", force_zip64=True) as fp,
+    ):
+        for chunk in _iterencode(dict_out, batch_size):
+            fp.write(chunk.encode())
+
+
+def _iterencode(dict_out: dict, batch_size: int):
+    """Encode `dict_out` in chunks, matching `json.dumps(dict_out, **_JSON_KWARGS)`."""
+    # `json.dump` would also stream, but can't use the (much faster) C encoder
+    yield "{"
+    for i, (key, value) in enumerate(dict_out.items()):
+        yield ("," if i else "") + json.dumps(str(key)) + ":"
+        if not isinstance(value, dict):
+            yield json.dumps(value, **_JSON_KWARGS)
+            continue
+        yield "{"
+        for j, batch in enumerate(batched(value.items(), batch_size)):
+            yield ("," if j else "") + json.dumps(dict(batch), **_JSON_KWARGS)[1:-1]
+        yield "}"
+    yield "}"
 
 
 def build_wkt_from_bbox(xmin: float, ymin: float, xmax: float, ymax: float) -> str:
@@ -37,3 +72,22 @@ def batched(iterable, n):
     it = iter(iterable)
     while batch := tuple(islice(it, n)):
         yield batch
+
+
+def thread_map_chunks(
+    func: Callable, items: Any, max_workers: int | None = None
+) -> np.ndarray:
+    """Apply `func` to contiguous chunks of `items` across a thread pool.
+
+    `func` takes a chunk (a slice of `items`) and returns an array or list,
+    and the results are concatenated in order. Shapely releases the GIL inside
+    GEOS calls, so threads scale without pickling the geometries to other
+    processes. More chunks than workers are used, since geometry sizes (and so
+    the time per chunk) vary wildly.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    edges = np.linspace(0, len(items), 4 * max_workers + 1).astype(int)
+    chunks = [items[i:j] for i, j in zip(edges[:-1], edges[1:])]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(func, chunks))
+    return np.concatenate(results)